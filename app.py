@@ -1,5 +1,6 @@
 import os
 import sys
+import shutil
 import asyncio
 import streamlit as st
 from dotenv import load_dotenv
@@ -7,12 +8,6 @@ from langchain_openai import ChatOpenAI
 from mcp_use import MCPAgent, MCPClient
 from st_social_media_links import SocialMediaIcons
 
-# ==================================================
-# CONFIGURACIÓN WINDOWS
-# ==================================================
-if sys.platform.startswith("win"):
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-
 # ==================================================
 # VARIABLES DE ENTORNO
 # ==================================================
@@ -20,6 +15,15 @@ load_dotenv()
 
 key = os.getenv("OPENAI_API_KEY")
 
+# ==================================================
+# CONFIGURACIÓN WINDOWS
+# ==================================================
+# El cliente MCP lanza server.py como subproceso stdio, lo que en Windows
+# requiere Proactor (política por defecto). MCP_USE_PROACTOR=0 cambia a
+# Selector cuando el servidor no se ejecuta como subproceso.
+if sys.platform.startswith("win") and os.getenv("MCP_USE_PROACTOR", "1") == "0":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
 # ==================================================
 # CONFIGURACIÓN STREAMLIT
 # ==================================================
@@ -95,8 +99,10 @@ with st.sidebar:
 
         temp_path = f"temp_{uploaded_file.name}"
 
+        uploaded_file.seek(0)
+
         with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+            shutil.copyfileobj(uploaded_file, f, length=1 << 20)
 
         st.success("Archivo cargado")
 
@@ -240,22 +246,29 @@ if ejecutar and consulta:
 # ==================================================
 if limpiar:
 
-    archivos_temp = [
-        f for f in os.listdir(".")
-        if f.startswith("temp_")
-    ]
+    encontrados = 0
 
-    if not archivos_temp:
-        st.info("No existen archivos temporales")
+    with os.scandir(".") as entradas:
 
-    for archivo in archivos_temp:
+        for entrada in entradas:
 
-        try:
-            os.remove(archivo)
-            st.success(f"Eliminado: {archivo}")
+            if not entrada.name.startswith("temp_"):
+                continue
+
+            if not entrada.is_file(follow_symlinks=False):
+                continue
 
-        except Exception:
-            st.warning(f"No se pudo eliminar: {archivo}")
+            encontrados += 1
+
+            try:
+                os.unlink(entrada.path)
+                st.success(f"Eliminado: {entrada.name}")
+
+            except Exception:
+                st.warning(f"No se pudo eliminar: {entrada.name}")
+
+    if not encontrados:
+        st.info("No existen archivos temporales")
 
 # ==================================================
 # FOOTER
@@ -1,23 +1,58 @@
 # Servidor MCP Optimizado
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 from pathlib import Path
-from typing import Dict, List, Optional, Union, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Union, Any
+import aiofiles
+from dotenv import load_dotenv
 import httpx
 import pandas as pd
-import PyPDF2
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from pypdf import PdfReader
 import plotly.express as px
 import plotly.graph_objects as go
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml.cssselect import CSSSelector
+import io
 import logging
+import os
+import stat as stat_mod
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 import json
+import orjson
+
+# Variables de entorno (.env)
+load_dotenv()
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def _lifespan(server: FastMCP) -> AsyncIterator[Dict[str, Any]]:
+    """Cliente HTTP compartido por las herramientas de la sesión: reutiliza conexiones (y HTTP/2)"""
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    ) as client:
+        yield {"http": client}
+
 # Instancia del servidor
-mcp = FastMCP("Demo")
+mcp = FastMCP("Demo", lifespan=_lifespan)
+
+# Máximo de caracteres devueltos por extraer_contenido_web
+LIMITE_CONTENIDO_WEB = 10000
+
+# Tamaño máximo por defecto de descargar_archivo_web (MAX_FILE_SIZE_MB en .env)
+MAX_DESCARGA_BYTES = int(os.getenv("MAX_FILE_SIZE_MB", "100")) * 1024 * 1024
 
 # ========== CLASES AUXILIARES ==========
 class FileHandler:
@@ -29,19 +64,22 @@ class FileHandler:
         if not path.exists():
             raise FileNotFoundError(f"El archivo {path} no existe")
     
+    @staticmethod
+    def stat_file(path: Path) -> os.stat_result:
+        """Obtiene los metadatos del archivo con una sola llamada al sistema, validando que exista"""
+        try:
+            return os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise FileNotFoundError(f"El archivo {path} no existe") from None
+    
     @staticmethod
     def read_dataframe(path: Path) -> pd.DataFrame:
-        """Lee un DataFrame desde CSV o Excel"""
-        FileHandler.validate_file_exists(path)
+        """Lee un DataFrame desde CSV, Excel, JSON o Parquet (cacheado por ruta, fecha de modificación y tamaño)"""
+        stat = FileHandler.stat_file(path)
         
-        if path.suffix.lower() == ".csv":
-            return pd.read_csv(path)
-        elif path.suffix.lower() in [".xlsx", ".xls"]:
-            return pd.read_excel(path)
-        elif path.suffix.lower() == ".json":
-            return pd.read_json(path)
-        else:
-            raise ValueError(f"Formato no soportado: {path.suffix}")
+        df = _read_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        # Copia superficial para que el llamador no altere la entrada cacheada
+        return df.copy(deep=False)
     
     @staticmethod
     def validate_columns(df: pd.DataFrame, columns: List[str]) -> None:
@@ -58,9 +96,9 @@ class ResponseFormatter:
         """Formato de respuesta exitosa"""
         return {
             "success": True,
-            "data": data,
+            "data": _to_json_safe(data),
             "message": message,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _timestamp()
         }
     
     @staticmethod
@@ -70,7 +108,7 @@ class ResponseFormatter:
             "success": False,
             "error": error,
             "details": details,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _timestamp()
         }
 
 # ========== HERRAMIENTAS BÁSICAS DE ARCHIVOS ==========
@@ -78,9 +116,9 @@ class ResponseFormatter:
 def analizar_archivo(archivo: Path) -> Dict:
     """Analiza las propiedades completas de un archivo"""
     try:
-        FileHandler.validate_file_exists(Path(archivo))
         path = Path(archivo)
-        stat = path.stat()
+        stat = FileHandler.stat_file(path)
+        es_archivo = stat_mod.S_ISREG(stat.st_mode)
         
         data = {
             "nombre": path.name,
@@ -89,12 +127,12 @@ def analizar_archivo(archivo: Path) -> Dict:
             "tamaño_legible": _format_file_size(stat.st_size),
             "fecha_creacion": datetime.fromtimestamp(stat.st_ctime).isoformat(),
             "fecha_modificacion": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-            "es_archivo": path.is_file(),
-            "es_directorio": path.is_dir(),
+            "es_archivo": es_archivo,
+            "es_directorio": stat_mod.S_ISDIR(stat.st_mode),
         }
         
         # Si es archivo de texto pequeño, incluir contenido
-        if path.is_file() and path.suffix.lower() in ['.txt', '.md', '.py', '.json'] and stat.st_size < 10000:
+        if es_archivo and path.suffix.lower() in ['.txt', '.md', '.py', '.json'] and stat.st_size < 10000:
             try:
                 data["contenido_preview"] = path.read_text(encoding="utf-8")[:1000]
             except:
@@ -134,6 +172,7 @@ def leer_documento(ruta: Path, limite_caracteres: int = 10000) -> Dict:
         FileHandler.validate_file_exists(path)
         
         if path.suffix.lower() == ".pdf":
+            # Texto completo (cacheado) para que longitud_total sea siempre real
             contenido = _extract_pdf_text(path)
         elif path.suffix.lower() in [".txt", ".md", ".csv", ".json", ".py"]:
             contenido = path.read_text(encoding="utf-8")
@@ -160,7 +199,7 @@ def leer_documento(ruta: Path, limite_caracteres: int = 10000) -> Dict:
 # ========== HERRAMIENTAS DE ANÁLISIS DE DATOS ==========
 @mcp.tool()
 def analizar_datos(ruta_archivo: Path, incluir_muestra: bool = True) -> Dict:
-    """Análisis completo de archivos de datos (CSV/Excel/JSON)"""
+    """Análisis completo de archivos de datos (CSV/Excel/JSON/Parquet)"""
     try:
         df = FileHandler.read_dataframe(Path(ruta_archivo))
         
@@ -169,7 +208,7 @@ def analizar_datos(ruta_archivo: Path, incluir_muestra: bool = True) -> Dict:
             "filas": len(df),
             "columnas": len(df.columns),
             "lista_columnas": list(df.columns),
-            "tipos_datos": df.dtypes.to_dict(),
+            "tipos_datos": {col: str(tipo) for col, tipo in df.dtypes.items()},
         }
         
         # Estadísticas descriptivas para columnas numéricas
@@ -179,14 +218,14 @@ def analizar_datos(ruta_archivo: Path, incluir_muestra: bool = True) -> Dict:
             estadisticas = numericas.describe().to_dict()
         
         # Información de valores faltantes
-        valores_faltantes = df.isnull().sum().to_dict()
+        valores_faltantes = _count_missing(df)
         
         # Muestra de datos (opcional)
         muestra = {}
         if incluir_muestra:
             muestra = {
-                "primeras_5_filas": df.head().to_dict('records'),
-                "ultimas_5_filas": df.tail().to_dict('records')
+                "primeras_5_filas": df.head().to_dict(orient="list"),
+                "ultimas_5_filas": df.tail().to_dict(orient="list")
             }
         
         data = {
@@ -233,14 +272,24 @@ def tabla_dinamica_avanzada(
         if funciones_invalidas:
             raise ValueError(f"Funciones no válidas: {funciones_invalidas}. Use: {funciones_validas}")
         
-        # Crear tabla dinámica
-        pivot_table = df.pivot_table(
-            index=index_cols,
-            columns=columns_cols,
-            values=values_col,
-            aggfunc=aggfunc,
-            fill_value=fill_value
-        )
+        # Crear tabla dinámica: una sola agrupación para todas las funciones.
+        # observed=True evita el producto cartesiano de categorías; sort=False omite el ordenamiento
+        agrupado = df.groupby(index_cols + columns_cols, observed=True, sort=False)[values_col].agg(aggfunc)
+        
+        # Misma semántica que pivot_table por función: sin grupos vacíos, relleno de NaN
+        # y sin columnas completamente vacías
+        piezas = []
+        for func in aggfunc:
+            serie = agrupado[func].dropna()
+            if columns_cols:
+                pieza = serie.unstack(columns_cols, fill_value=fill_value)
+                if fill_value is not None:
+                    pieza = pieza.fillna(fill_value)
+            else:
+                # Sin columnas que pivotar: una sola columna con el nombre del valor, como pivot_table
+                pieza = serie.sort_index().to_frame(values_col)
+            piezas.append(pieza.dropna(axis=1, how="all"))
+        pivot_table = pd.concat(piezas, axis=1, keys=aggfunc)
         
         # Convertir a formato serializable
         if len(aggfunc) == 1:
@@ -290,9 +339,9 @@ def crear_visualizacion(
         titulo = configuracion.get('titulo', f'Gráfico {tipo_grafico}')
         fig.update_layout(title=titulo, template=configuracion.get('template', 'plotly'))
         
-        # Guardar
+        # Guardar como fragmento HTML; plotly.js se carga desde el CDN en lugar de incrustarse
         ruta_salida = Path(ruta_archivo).with_suffix('.html')
-        fig.write_html(ruta_salida)
+        fig.write_html(ruta_salida, include_plotlyjs="cdn", full_html=False)
         
         data = {
             "archivo_salida": str(ruta_salida),
@@ -300,6 +349,12 @@ def crear_visualizacion(
             "columnas_utilizadas": columnas
         }
         
+        # Figura en JSON (opcional) para reutilizarla sin volver a generar el HTML
+        if configuracion.get('exportar_json', False):
+            ruta_json = ruta_salida.with_name(f"{ruta_salida.stem}.figure.json")
+            ruta_json.write_text(fig.to_json(), encoding="utf-8")
+            data["archivo_json"] = str(ruta_json)
+        
         return ResponseFormatter.success(data, f"Visualización {tipo_grafico} creada exitosamente")
         
     except Exception as e:
@@ -312,108 +367,168 @@ async def buscar_repositorios_github(
     query: str, 
     sort: str = "stars", 
     order: str = "desc", 
-    per_page: int = 10
+    per_page: int = 10,
+    ctx: Context = None
 ) -> Dict:
     """Búsqueda avanzada de repositorios en GitHub"""
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            url = "https://api.github.com/search/repositories"
-            params = {
-                "q": query,
-                "sort": sort,
-                "order": order,
-                "per_page": min(per_page, 100)  # Límite de API
-            }
-            
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            
-            data_json = response.json()
-            repositorios = []
-            
-            for repo in data_json.get("items", []):
-                repositorios.append({
-                    "nombre_completo": repo["full_name"],
-                    "descripcion": repo.get("description", "Sin descripción"),
-                    "url": repo["html_url"],
-                    "estrellas": repo["stargazers_count"],
-                    "forks": repo["forks_count"],
-                    "lenguaje": repo.get("language", "No especificado"),
-                    "actualizado": repo["updated_at"],
-                    "temas": repo.get("topics", [])
-                })
-            
-            data = {
-                "repositorios": repositorios,
-                "total_encontrados": data_json["total_count"],
-                "query_utilizada": query
-            }
-            
-            return ResponseFormatter.success(data, f"Se encontraron {len(repositorios)} repositorios")
+        url = "https://api.github.com/search/repositories"
+        params = {
+            "q": query,
+            "sort": sort,
+            "order": order,
+            "per_page": min(per_page, 100)  # Límite de API
+        }
+        
+        response = await _http_client(ctx).get(url, params=params)
+        response.raise_for_status()
+        
+        data_json = response.json()
+        repositorios = []
+        
+        for repo in data_json.get("items", []):
+            repositorios.append({
+                "nombre_completo": repo["full_name"],
+                "descripcion": repo.get("description", "Sin descripción"),
+                "url": repo["html_url"],
+                "estrellas": repo["stargazers_count"],
+                "forks": repo["forks_count"],
+                "lenguaje": repo.get("language", "No especificado"),
+                "actualizado": repo["updated_at"],
+                "temas": repo.get("topics", [])
+            })
+        
+        data = {
+            "repositorios": repositorios,
+            "total_encontrados": data_json["total_count"],
+            "query_utilizada": query
+        }
+        
+        return ResponseFormatter.success(data, f"Se encontraron {len(repositorios)} repositorios")
             
     except Exception as e:
         logger.error(f"Error buscando repositorios: {e}")
         return ResponseFormatter.error(str(e))
 
 @mcp.tool()
-async def extraer_contenido_web(url: str, selector_css: Optional[str] = None) -> Dict:
+async def extraer_contenido_web(url: str, selector_css: Optional[str] = None, ctx: Context = None) -> Dict:
     """Extrae contenido de páginas web con opciones avanzadas"""
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.get(url)
+        # Selector inválido: fallar antes de descargar nada
+        selector = CSSSelector(selector_css, translator="html") if selector_css else None
+        
+        async with _http_client(ctx).stream("GET", url) as response:
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, "html.parser")
-            
-            if selector_css:
-                elementos = soup.select(selector_css)
-                contenido = "\n".join([elem.get_text(strip=True) for elem in elementos])
-            else:
-                contenido = soup.get_text(strip=True)
+            # Parseo incremental: el árbol crece con cada bloque descargado
+            parser = etree.HTMLPullParser(events=("start",), encoding=response.charset_encoding)
+            raiz = None
+            leidos = 0
+            proxima_revision = 1 << 16
+            lectura_completa = True
             
-            data = {
-                "url": url,
-                "contenido": contenido[:10000],  # Límite para evitar respuestas muy grandes
-                "longitud_total": len(contenido),
-                "titulo": soup.title.string if soup.title else "Sin título",
-                "selector_usado": selector_css
-            }
-            
-            return ResponseFormatter.success(data, "Contenido web extraído exitosamente")
+            async for chunk in response.aiter_bytes(chunk_size=1 << 16):
+                parser.feed(chunk)
+                leidos += len(chunk)
+                for _, elem in parser.read_events():
+                    if raiz is None:
+                        raiz = elem.getroottree().getroot()
+                
+                # Revisiones en intervalos geométricos: coste total lineal en el tamaño de la página
+                if raiz is not None and leidos >= proxima_revision:
+                    proxima_revision *= 2
+                    if len(_extract_html_text(raiz, selector)) >= LIMITE_CONTENIDO_WEB:
+                        lectura_completa = False
+                        break
+        
+        try:
+            raiz = parser.close()
+        except etree.XMLSyntaxError:
+            pass  # Documento vacío o ilegible
+        
+        contenido = _extract_html_text(raiz, selector) if raiz is not None else ""
+        titulo = (raiz.findtext(".//title") or "").strip() if raiz is not None else ""
+        
+        data = {
+            "url": url,
+            "contenido": contenido[:LIMITE_CONTENIDO_WEB],  # Límite para evitar respuestas muy grandes
+            "longitud_total": len(contenido),
+            "lectura_completa": lectura_completa,
+            "titulo": titulo or "Sin título",
+            "selector_usado": selector_css
+        }
+        
+        return ResponseFormatter.success(data, "Contenido web extraído exitosamente")
             
     except Exception as e:
         logger.error(f"Error extrayendo contenido web: {e}")
         return ResponseFormatter.error(str(e))
 
 @mcp.tool()
-async def descargar_archivo_web(url: str, ruta_destino: Path, sobrescribir: bool = False) -> Dict:
-    """Descarga archivos desde URLs con validaciones mejoradas"""
+async def descargar_archivo_web(
+    url: str,
+    ruta_destino: Path,
+    sobrescribir: bool = False,
+    max_bytes: Optional[int] = None,
+    ctx: Context = None
+) -> Dict:
+    """Descarga archivos desde URLs con validaciones mejoradas y límite de tamaño (max_bytes solo puede reducirlo)"""
     try:
         path = Path(ruta_destino)
+        # El llamador solo puede reducir el límite configurado, nunca ampliarlo
+        limite = MAX_DESCARGA_BYTES if max_bytes is None else min(max_bytes, MAX_DESCARGA_BYTES)
         
         # Verificar si el archivo existe
         if path.exists() and not sobrescribir:
             raise FileExistsError(f"El archivo {path} ya existe. Use sobrescribir=True para reemplazarlo")
         
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.get(url)
+        async with _http_client(ctx).stream("GET", url, timeout=60) as response:
             response.raise_for_status()
             
+            # Rechazar antes de escribir si el servidor declara un tamaño excesivo
+            declarado = int(response.headers.get("content-length", 0))
+            if declarado > limite:
+                raise ValueError(
+                    f"El archivo ({_format_file_size(declarado)}) supera el límite de {_format_file_size(limite)}"
+                )
+            
             # Crear directorio padre si no existe
             path.parent.mkdir(parents=True, exist_ok=True)
             
-            # Guardar archivo
-            path.write_bytes(response.content)
+            # Guardar por bloques en un temporal; el destino solo se reemplaza si la descarga termina
+            tmp = path.with_name(f"{path.name}.tmp")
+            total = 0
+            try:
+                async with aiofiles.open(tmp, "wb") as f:
+                    if declarado and hasattr(os, "posix_fallocate"):
+                        try:
+                            os.posix_fallocate(f.fileno(), 0, declarado)
+                        except OSError:
+                            pass  # Sistema de archivos sin soporte: se escribe sin reservar
+                    
+                    async for chunk in response.aiter_bytes(chunk_size=1 << 16):
+                        total += len(chunk)
+                        # Content-Length puede faltar o no coincidir: se controla también al escribir
+                        if total > limite:
+                            raise ValueError(f"La descarga supera el límite de {_format_file_size(limite)}")
+                        await f.write(chunk)
+                    
+                    # Ajustar al tamaño real si la reserva fue mayor (p. ej. contenido comprimido)
+                    await f.truncate()
+                os.replace(tmp, path)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
             
             data = {
                 "url": url,
                 "archivo_destino": str(path),
-                "tamaño_bytes": len(response.content),
-                "tamaño_legible": _format_file_size(len(response.content)),
+                "tamaño_bytes": total,
+                "tamaño_legible": _format_file_size(total),
                 "tipo_contenido": response.headers.get("content-type", "desconocido")
             }
-            
-            return ResponseFormatter.success(data, "Archivo descargado exitosamente")
+        
+        return ResponseFormatter.success(data, "Archivo descargado exitosamente")
             
     except Exception as e:
         logger.error(f"Error descargando archivo: {e}")
@@ -430,12 +545,32 @@ def convertir_formato_datos(
     try:
         if opciones is None:
             opciones = {}
-            
-        df = FileHandler.read_dataframe(Path(archivo_entrada))
         
         # Generar nombre de archivo de salida
         archivo_salida = Path(archivo_entrada).with_suffix(f".{formato_salida}")
         
+        # Se escribe en un temporal y se renombra al terminar: un fallo no deja un archivo a medias
+        tmp = archivo_salida.with_name(f"{archivo_salida.name}.tmp")
+        
+        # CSV → Parquet/JSON con opciones por defecto: conversión por bloques sin cargar el archivo completo
+        entrada = Path(archivo_entrada)
+        if entrada.suffix.lower() == ".csv" and formato_salida in ["parquet", "json"] and not opciones:
+            FileHandler.stat_file(entrada)
+            try:
+                filas = _convert_csv_streaming(entrada, tmp, formato_salida)
+                os.replace(tmp, archivo_salida)
+                return ResponseFormatter.success(
+                    _conversion_data(archivo_entrada, archivo_salida, formato_salida, filas),
+                    f"Conversión a {formato_salida} completada"
+                )
+            except pa.ArrowInvalid as e:
+                # Tipos inferidos del primer bloque que no encajan más adelante: conversión completa
+                logger.warning(f"Conversión por bloques no posible, se lee el archivo completo: {e}")
+            finally:
+                tmp.unlink(missing_ok=True)
+        
+        df = FileHandler.read_dataframe(entrada)
+        
         # Opciones por defecto para cada formato
         opciones_defecto = {
             "json": {"orient": "records", "indent": 2},
@@ -448,25 +583,25 @@ def convertir_formato_datos(
         opts_finales = {**opciones_defecto.get(formato_salida, {}), **opciones}
         
         # Realizar conversión
-        if formato_salida == "json":
-            df.to_json(archivo_salida, **opts_finales)
-        elif formato_salida == "csv":
-            df.to_csv(archivo_salida, **opts_finales)
-        elif formato_salida == "xlsx":
-            df.to_excel(archivo_salida, **opts_finales)
-        elif formato_salida == "parquet":
-            df.to_parquet(archivo_salida, **opts_finales)
-        else:
-            formatos_soportados = ["json", "csv", "xlsx", "parquet"]
-            raise ValueError(f"Formato '{formato_salida}' no soportado. Use: {formatos_soportados}")
+        try:
+            if formato_salida == "json":
+                df.to_json(tmp, **opts_finales)
+            elif formato_salida == "csv":
+                df.to_csv(tmp, **opts_finales)
+            elif formato_salida == "xlsx":
+                # Con una ruta, pandas deduce el motor de la extensión (.tmp no la tiene)
+                with open(tmp, "wb") as f:
+                    df.to_excel(f, **opts_finales)
+            elif formato_salida == "parquet":
+                df.to_parquet(tmp, **opts_finales)
+            else:
+                formatos_soportados = ["json", "csv", "xlsx", "parquet"]
+                raise ValueError(f"Formato '{formato_salida}' no soportado. Use: {formatos_soportados}")
+            os.replace(tmp, archivo_salida)
+        finally:
+            tmp.unlink(missing_ok=True)
         
-        data = {
-            "archivo_entrada": str(archivo_entrada),
-            "archivo_salida": str(archivo_salida),
-            "formato_origen": Path(archivo_entrada).suffix,
-            "formato_destino": f".{formato_salida}",
-            "filas_procesadas": len(df)
-        }
+        data = _conversion_data(archivo_entrada, archivo_salida, formato_salida, len(df))
         
         return ResponseFormatter.success(data, f"Conversión a {formato_salida} completada")
         
@@ -475,39 +610,297 @@ def convertir_formato_datos(
         return ResponseFormatter.error(str(e))
 
 # ========== FUNCIONES AUXILIARES ==========
+def _http_client(ctx: Context) -> httpx.AsyncClient:
+    """Cliente HTTP creado por el lifespan de la sesión actual"""
+    return ctx.request_context.lifespan_context["http"]
+
+_timestamp_cache = (0, "")
+
+def _timestamp() -> str:
+    """Marca de tiempo ISO con resolución de segundos, formateada una vez por segundo"""
+    global _timestamp_cache
+    ahora = int(time.time())
+    if ahora != _timestamp_cache[0]:
+        _timestamp_cache = (ahora, datetime.fromtimestamp(ahora).isoformat(timespec="seconds"))
+    return _timestamp_cache[1]
+
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
 def _format_file_size(size_bytes: int) -> str:
     """Convierte bytes a formato legible"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_bytes < 1024:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024
-    return f"{size_bytes:.1f} TB"
+    size_bytes = int(size_bytes)
+    # Cada unidad equivale a 10 bits más: bit_length elige la unidad sin bucle
+    unit = min(max(size_bytes.bit_length() - 1, 0) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (unit * 10)):.1f} {_SIZE_UNITS[unit]}"
+
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+def _json_default(valor: Any) -> Any:
+    """Serializa los valores que orjson no admite: faltantes como null, fechas en ISO y el resto como texto"""
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    try:
+        if pd.isna(valor):
+            return None
+    except (TypeError, ValueError):
+        pass  # No es un escalar (p. ej. arrays)
+    return str(valor)
+
+def _to_json_safe(data: Any) -> Any:
+    """Convierte escalares numpy/pandas a tipos nativos de Python usando orjson"""
+    try:
+        return orjson.loads(orjson.dumps(data, default=_json_default, option=_ORJSON_OPTIONS))
+    except orjson.JSONEncodeError:
+        # Claves no soportadas (p. ej. tuplas de tablas dinámicas): se entrega tal cual
+        return data
+
+@lru_cache(maxsize=32)
+def _read_cached(path_str: str, mtime_ns: int, size: int) -> pd.DataFrame:
+    """Parsea el archivo de datos; mtime y tamaño forman parte de la clave para invalidar la caché"""
+    path = Path(path_str)
+    suffix = path.suffix.lower()
+    
+    if suffix == ".parquet":
+        return pd.read_parquet(path)
+    
+    # Sidecar Parquet generado en una lectura previa del mismo archivo
+    sidecar = path.with_name(f"{path.name}.parquet")
+    if suffix == ".csv" and _is_fresh_sidecar(sidecar, mtime_ns):
+        return pd.read_parquet(sidecar, dtype_backend="pyarrow")
+    elif suffix in [".xlsx", ".xls"] and _is_fresh_sidecar(sidecar, mtime_ns):
+        return pd.read_parquet(sidecar)
+    
+    if suffix == ".csv":
+        df = _read_csv(path)
+    elif suffix in [".xlsx", ".xls"]:
+        try:
+            df = pd.read_excel(path, engine="calamine")
+        except ImportError:
+            # python-calamine no instalado: motor por defecto (openpyxl/xlrd)
+            df = pd.read_excel(path)
+    elif suffix == ".json":
+        return pd.read_json(path)
+    else:
+        raise ValueError(f"Formato no soportado: {path.suffix}")
+    
+    _write_parquet_sidecar(df, sidecar)
+    return df
+
+def _read_csv(path: Path) -> pd.DataFrame:
+    """Lee CSV con PyArrow conservando el comportamiento del motor C de pandas"""
+    try:
+        df = pd.read_csv(path, engine="pyarrow", dtype_backend="pyarrow")
+    except (pd.errors.ParserError, pa.ArrowInvalid):
+        # Filas irregulares u otros casos que PyArrow rechaza: el motor C los tolera
+        return pd.read_csv(path, dtype_backend="pyarrow")
+    
+    df.columns = _dedupe_columns(list(df.columns))
+    # El motor C no infiere fechas: se conservan como texto (y siguen siendo serializables)
+    for col, tipo in df.dtypes.items():
+        if isinstance(tipo, pd.ArrowDtype) and _is_temporal(tipo.pyarrow_dtype):
+            df[col] = df[col].astype(pd.ArrowDtype(pa.string()))
+    return df
+
+def _dedupe_columns(nombres: List[str]) -> List[str]:
+    """Renombra columnas repetidas igual que el motor C de pd.read_csv: a, a.1, a.2"""
+    existentes = set(nombres)
+    cuentas = defaultdict(int)
+    resultado = []
+    for nombre in nombres:
+        original = nombre
+        cuenta = cuentas[nombre]
+        while cuenta > 0:
+            cuentas[original] = cuenta + 1
+            nombre = f"{original}.{cuenta}"
+            cuenta = cuenta + 1 if nombre in existentes else cuentas[nombre]
+        resultado.append(nombre)
+        cuentas[nombre] = cuenta + 1
+    return resultado
+
+def _is_temporal(tipo: pa.DataType) -> bool:
+    """Indica si el tipo Arrow es una fecha o marca de tiempo inferida del CSV"""
+    return pa.types.is_date(tipo) or pa.types.is_timestamp(tipo)
+
+def _is_fresh_sidecar(sidecar: Path, source_mtime_ns: int) -> bool:
+    """Indica si el sidecar existe y no es más antiguo que el archivo de origen"""
+    try:
+        return sidecar.stat().st_mtime_ns >= source_mtime_ns
+    except OSError:
+        return False
+
+def _write_parquet_sidecar(df: pd.DataFrame, sidecar: Path) -> None:
+    """Guarda una copia Parquet del DataFrame; un fallo no interrumpe la lectura"""
+    tmp = sidecar.with_name(f"{sidecar.name}.tmp")
+    try:
+        df.to_parquet(tmp, engine="pyarrow", compression="zstd")
+        os.replace(tmp, sidecar)
+    except Exception as e:
+        logger.warning(f"No se pudo escribir la caché {sidecar}: {e}")
+        tmp.unlink(missing_ok=True)
+
+def _write_text_sidecar(texto: str, sidecar: Path) -> None:
+    """Guarda el texto extraído de forma atómica; un fallo no interrumpe la lectura"""
+    tmp = sidecar.with_name(f"{sidecar.name}.tmp")
+    try:
+        tmp.write_text(texto, encoding="utf-8")
+        os.replace(tmp, sidecar)
+    except Exception as e:
+        logger.warning(f"No se pudo escribir la caché {sidecar}: {e}")
+        tmp.unlink(missing_ok=True)
 
 def _extract_pdf_text(path: Path) -> str:
-    """Extrae texto de archivos PDF"""
-    with open(path, "rb") as file:
-        reader = PyPDF2.PdfReader(file)
-        return " ".join([page.extract_text() for page in reader.pages])
+    """Extrae texto de archivos PDF (cacheado por ruta y fecha de modificación)"""
+    stat = path.stat()
+    return _extract_pdf_text_cached(str(path.resolve()), stat.st_mtime_ns)
+
+@lru_cache(maxsize=32)
+def _extract_pdf_text_cached(path_str: str, mtime_ns: int) -> str:
+    """Usa el sidecar .cache.txt si está vigente; si no, extrae el texto completo y lo genera"""
+    path = Path(path_str)
+    sidecar = path.with_name(f"{path.name}.cache.txt")
+    if _is_fresh_sidecar(sidecar, mtime_ns):
+        return sidecar.read_text(encoding="utf-8")
+    
+    texto = _extract_pdf_pages(path)
+    _write_text_sidecar(texto, sidecar)
+    return texto
+
+def _extract_pdf_pages(path: Path) -> str:
+    """Extrae texto de archivos PDF en paralelo por página"""
+    contenido_pdf = path.read_bytes()
+    num_paginas = len(PdfReader(io.BytesIO(contenido_pdf)).pages)
+    local = threading.local()
+    
+    def extraer_pagina(numero: int) -> str:
+        # PdfReader no es seguro entre hilos: cada hilo usa su propio lector
+        if not hasattr(local, "reader"):
+            local.reader = PdfReader(io.BytesIO(contenido_pdf))
+        return local.reader.pages[numero].extract_text() or ""
+    
+    buffer = io.StringIO()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for i, texto in enumerate(executor.map(extraer_pagina, range(num_paginas))):
+            if i:
+                buffer.write(" ")
+            buffer.write(texto)
+    return buffer.getvalue()
+
+def _count_missing(df: pd.DataFrame) -> Dict[str, int]:
+    """Valores faltantes por columna; en columnas Arrow se lee el null_count sin crear máscaras"""
+    faltantes = {}
+    for col, serie in df.items():
+        if isinstance(serie.dtype, pd.ArrowDtype):
+            faltantes[col] = serie.array.__arrow_array__().null_count
+        else:
+            faltantes[col] = int(serie.isna().sum())
+    return faltantes
+
+_TAGS_SIN_TEXTO = frozenset({"script", "style", "noscript", "template"})
+
+def _extract_html_text(raiz: etree._Element, selector: Optional[CSSSelector]) -> str:
+    """Texto de la página o de los elementos que coinciden con el selector CSS"""
+    if selector is not None:
+        return "\n".join(
+            "".join(texto.strip() for texto in _iter_visible_text(elem)) for elem in selector(raiz)
+        )
+    cuerpo = raiz.find("body")
+    nodo = cuerpo if cuerpo is not None else raiz
+    return " ".join(texto.strip() for texto in _iter_visible_text(nodo) if texto.strip())
+
+def _iter_visible_text(elem: etree._Element):
+    """Como itertext(), pero sin el contenido de script, style, noscript y template"""
+    if elem.text:
+        yield elem.text
+    pila = []
+    for hijo in reversed(elem):
+        if hijo.tail:
+            pila.append(hijo.tail)
+        pila.append(hijo)
+    while pila:
+        item = pila.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+        # Comentarios, instrucciones y etiquetas no visibles: solo cuenta su tail (ya apilado)
+        if not isinstance(item.tag, str) or item.tag in _TAGS_SIN_TEXTO:
+            continue
+        if item.text:
+            yield item.text
+        for hijo in reversed(item):
+            if hijo.tail:
+                pila.append(hijo.tail)
+            pila.append(hijo)
+
+def _conversion_data(archivo_entrada: Path, archivo_salida: Path, formato_salida: str, filas: int) -> Dict:
+    """Metadatos de respuesta de convertir_formato_datos"""
+    return {
+        "archivo_entrada": str(archivo_entrada),
+        "archivo_salida": str(archivo_salida),
+        "formato_origen": Path(archivo_entrada).suffix,
+        "formato_destino": f".{formato_salida}",
+        "filas_procesadas": filas
+    }
+
+# Valores nulos iguales a los de pd.read_csv(engine="pyarrow"): cadenas vacías, "None" y "<NA>" incluidos
+_CSV_CONVERT_OPTIONS = pa_csv.ConvertOptions(
+    null_values=[*pa_csv.ConvertOptions().null_values, "None", "<NA>"],
+    strings_can_be_null=True
+)
+
+def _convert_csv_streaming(entrada: Path, salida: Path, formato: str) -> int:
+    """Convierte CSV a Parquet o JSON por bloques de 16 MB; devuelve el número de filas escritas"""
+    reader = pa_csv.open_csv(
+        entrada,
+        read_options=pa_csv.ReadOptions(block_size=1 << 24),
+        convert_options=_CSV_CONVERT_OPTIONS
+    )
+    # Mismas reglas que _read_csv: columnas repetidas renombradas y fechas conservadas como texto
+    nombres = _dedupe_columns(reader.schema.names)
+    esquema = pa.schema([
+        pa.field(nombre, pa.string() if _is_temporal(campo.type) else campo.type)
+        for nombre, campo in zip(nombres, reader.schema)
+    ])
+    bloques = (pa.Table.from_batches([batch]).rename_columns(nombres).cast(esquema) for batch in reader)
+    filas = 0
+    
+    if formato == "parquet":
+        with pq.ParquetWriter(salida, esquema) as writer:
+            for tabla in bloques:
+                writer.write_table(tabla)
+                filas += tabla.num_rows
+        return filas
+    
+    # JSON: mismo formato que to_json(orient="records", indent=2), escrito bloque a bloque
+    with open(salida, "w", encoding="utf-8") as f:
+        f.write("[")
+        for tabla in bloques:
+            if not tabla.num_rows:
+                continue
+            df = tabla.to_pandas(types_mapper=pd.ArrowDtype)
+            cuerpo = df.to_json(orient="records", indent=2).strip()[1:-1].strip()
+            f.write(",\n  " if filas else "\n  ")
+            f.write(cuerpo)
+            filas += tabla.num_rows
+        f.write("\n]" if filas else "]")
+    return filas
+
+_PLOT_BUILDERS: Dict[str, Callable[[pd.DataFrame, List[str], Dict], go.Figure]] = {
+    "bar": lambda df, cols, extra: px.bar(df, x=cols[0], y=cols[1], **extra),
+    "line": lambda df, cols, extra: px.line(df, x=cols[0], y=cols[1], **extra),
+    "scatter": lambda df, cols, extra: px.scatter(df, x=cols[0], y=cols[1], **extra),
+    "pie": lambda df, cols, extra: px.pie(df, names=cols[0], values=cols[1], **extra),
+    "histogram": lambda df, cols, extra: px.histogram(df, x=cols[0], **extra),
+    "box": lambda df, cols, extra: px.box(df, x=cols[0], y=cols[1] if len(cols) > 1 else None, **extra),
+}
 
 def _create_plotly_figure(df: pd.DataFrame, tipo: str, config: Dict) -> go.Figure:
     """Crea figuras de Plotly según tipo y configuración"""
-    columnas = config['columnas']
+    builder = _PLOT_BUILDERS.get(tipo)
+    if builder is None:
+        raise ValueError(f"Tipo '{tipo}' no soportado. Use: {list(_PLOT_BUILDERS)}")
     
-    if tipo == "bar":
-        return px.bar(df, x=columnas[0], y=columnas[1], **config.get('extra_params', {}))
-    elif tipo == "line":
-        return px.line(df, x=columnas[0], y=columnas[1], **config.get('extra_params', {}))
-    elif tipo == "scatter":
-        return px.scatter(df, x=columnas[0], y=columnas[1], **config.get('extra_params', {}))
-    elif tipo == "pie":
-        return px.pie(df, names=columnas[0], values=columnas[1], **config.get('extra_params', {}))
-    elif tipo == "histogram":
-        return px.histogram(df, x=columnas[0], **config.get('extra_params', {}))
-    elif tipo == "box":
-        return px.box(df, x=columnas[0], y=columnas[1] if len(columnas) > 1 else None, **config.get('extra_params', {}))
-    else:
-        tipos_soportados = ["bar", "line", "scatter", "pie", "histogram", "box"]
-        raise ValueError(f"Tipo '{tipo}' no soportado. Use: {tipos_soportados}")
+    extra = config.get('extra_params') or {}
+    return builder(df, config['columnas'], extra)
 
 # ========== EJECUCIÓN DEL SERVIDOR ==========
 if __name__ == "__main__":